@@ -1,20 +1,75 @@
 import streamlit as st
+import asyncio
+import json
 import os
-from openai import OpenAI
+import time
+import uuid
+from collections import deque
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from pitch_engine import (
     get_default_pitch_data,
     get_completion_stats,
-    ingest,
+    ingest_async,
+    parse_ingest_response,
     evaluate,
-    FIELD_INFO
+    FIELD_NAMES
 )
 
-# Load environment variables
-load_dotenv()
-
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client once per process; reruns reuse the same
+# connection pool instead of paying a fresh TLS handshake per call.
+# load_dotenv lives inside the cached constructors so .env is read once
+# per process rather than on every script rerun.
+@st.cache_resource
+def get_openai_client():
+    load_dotenv()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+@st.cache_resource
+def get_async_openai_client():
+    load_dotenv()
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_evaluate(pitch_items):
+    """Memoize evaluations so an unchanged pitch doesn't re-hit the API.
+
+    Takes the pitch as a hashable tuple of (field_key, value, state)
+    triples; the client comes from the resource cache so it stays out of
+    the cache key.
+    """
+    pitch_data = {key: {"value": value, "state": state} for key, value, state in pitch_items}
+    return evaluate(client=get_openai_client(), pitch_data=pitch_data)
+
+# Transcript persistence: the full conversation lives on disk as JSONL
+# (O(1) appends); session state only holds a bounded tail, so per-session
+# memory stays constant in long chats
+TRANSCRIPT_DIR = "transcripts"
+MESSAGES_TAIL_SIZE = 20
+INITIAL_GREETING = {"role": "assistant", "content": "So, what problem are you working on solving?"}
+
+def new_transcript_file():
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    return os.path.join(TRANSCRIPT_DIR, f"session-{uuid.uuid4().hex}.jsonl")
+
+def append_to_transcript(message):
+    with open(st.session_state.transcript_file, "a") as f:
+        f.write(json.dumps(message) + "\n")
+
+def add_message(message):
+    """Append a message to the in-memory tail and the on-disk transcript"""
+    st.session_state.messages.append(message)
+    append_to_transcript(message)
+
+def reset_session():
+    """Clear the pitch and conversation and return to ingest mode"""
+    st.session_state.pitch_data = get_default_pitch_data()
+    st.session_state.messages = deque(maxlen=MESSAGES_TAIL_SIZE)
+    st.session_state.transcript_file = new_transcript_file()
+    add_message(INITIAL_GREETING)
+    st.session_state.mode = "ingest"
+    st.session_state.evaluation_result = None
+    st.rerun()
 
 # Page config
 st.set_page_config(
@@ -25,9 +80,9 @@ st.set_page_config(
 
 # Initialize session state
 if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {"role": "assistant", "content": "So, what problem are you working on solving?"}
-    ]
+    st.session_state.messages = deque(maxlen=MESSAGES_TAIL_SIZE)
+    st.session_state.transcript_file = new_transcript_file()
+    add_message(INITIAL_GREETING)
 
 if "pitch_data" not in st.session_state:
     st.session_state.pitch_data = get_default_pitch_data()
@@ -51,7 +106,7 @@ with st.sidebar:
     # Field status
     st.subheader("Field Status")
     for field_key, field_data in st.session_state.pitch_data.items():
-        field_name = FIELD_INFO[field_key]["name"]
+        field_name = FIELD_NAMES[field_key]
         state = field_data["state"]
 
         if state == "complete":
@@ -63,18 +118,16 @@ with st.sidebar:
 
     # Reset button
     if st.button("Reset Pitch"):
-        st.session_state.pitch_data = get_default_pitch_data()
-        st.session_state.messages = [
-            {"role": "assistant", "content": "So, what problem are you working on solving?"}
-        ]
-        st.session_state.mode = "ingest"
-        st.session_state.evaluation_result = None
-        st.rerun()
+        reset_session()
 
 # Title
 st.title("🚀 Startup Pitch Bot")
 
-if st.session_state.mode == "ingest":
+@st.fragment
+def chat_fragment():
+    """Chat history and input, isolated so submissions rerun only this
+    fragment instead of the whole script (sidebar, title, etc.)."""
+
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -83,31 +136,67 @@ if st.session_state.mode == "ingest":
     # Regular chat input
     if prompt := st.chat_input("Share your pitch details..."):
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
-
-        # Get AI response via ingest function
-        with st.spinner("Thinking..."):
-            try:
-                result = ingest(
-                    client=client,
-                    conversation_history=st.session_state.messages,
-                    pitch_data=st.session_state.pitch_data
-                )
-
-                # Update pitch data
-                st.session_state.pitch_data = result["pitch_data"]
-
-                # Add response
-                st.session_state.messages.append({"role": "assistant", "content": result["response"]})
+        add_message({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.write(prompt)
+
+        # Stream the AI response so the user sees tokens as they arrive;
+        # the async client yields the thread to other sessions while
+        # waiting on the network
+        async def stream_reply(placeholder):
+            response_stream = await ingest_async(
+                client=get_async_openai_client(),
+                conversation_history=list(st.session_state.messages),
+                pitch_data=st.session_state.pitch_data,
+                stream=True
+            )
 
-                # Check if ready for evaluation
-                if result["ready_for_evaluation"]:
-                    st.session_state.mode = "evaluate"
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                st.exception(e)
+            # Buffer chunks in a list and join on read: repeated
+            # `content += delta` copies O(n^2) bytes over a long reply
+            buffer = []
+            last_render = 0.0
+            async for chunk in response_stream:
+                delta = chunk.choices[0].delta.content or ""
+                buffer.append(delta)
+                now = time.monotonic()
+                if now - last_render < 0.05:
+                    continue
+                last_render = now
+                # Hide the technical blocks while streaming
+                visible = "".join(buffer).split("---UPDATE---")[0].split("---READY_FOR_EVALUATION---")[0]
+                placeholder.markdown(visible)
+            return "".join(buffer)
+
+        try:
+            with st.chat_message("assistant"):
+                placeholder = st.empty()
+                content = asyncio.run(stream_reply(placeholder))
+                placeholder.markdown(content.split("---UPDATE---")[0].split("---READY_FOR_EVALUATION---")[0])
+
+            result = parse_ingest_response(content, st.session_state.pitch_data)
+
+            # Update pitch data
+            pitch_changed = result["pitch_data"] != st.session_state.pitch_data
+            st.session_state.pitch_data = result["pitch_data"]
+
+            # Add response
+            add_message({"role": "assistant", "content": result["response"]})
+
+            # Check if ready for evaluation
+            if result["ready_for_evaluation"]:
+                st.session_state.mode = "evaluate"
+
+            # Full-app rerun only when the sidebar or mode is stale; a
+            # pure chat turn is already fully rendered above, so skip the
+            # redundant redraw of the whole script
+            if pitch_changed or result["ready_for_evaluation"]:
+                st.rerun()
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+            st.exception(e)
 
-        st.rerun()
+if st.session_state.mode == "ingest":
+    chat_fragment()
 
 elif st.session_state.mode == "evaluate":
     # Show pitch summary first
@@ -115,7 +204,7 @@ elif st.session_state.mode == "evaluate":
     st.markdown("---")
 
     for field_key, field_data in st.session_state.pitch_data.items():
-        field_name = FIELD_INFO[field_key]["name"]
+        field_name = FIELD_NAMES[field_key]
         value = field_data.get("value", "")
 
         st.subheader(f"🟢 {field_name}")
@@ -141,22 +230,17 @@ elif st.session_state.mode == "evaluate":
 
     with col3:
         if st.button("🔄 Start Over", use_container_width=True):
-            st.session_state.pitch_data = get_default_pitch_data()
-            st.session_state.messages = [
-                {"role": "assistant", "content": "So, what problem are you working on solving?"}
-            ]
-            st.session_state.mode = "ingest"
-            st.session_state.evaluation_result = None
-            st.rerun()
+            reset_session()
 
 elif st.session_state.mode == "evaluation_result":
     # Run evaluation
     if st.session_state.evaluation_result is None:
         with st.spinner("Evaluating your pitch from an investor perspective..."):
-            st.session_state.evaluation_result = evaluate(
-                client=client,
-                pitch_data=st.session_state.pitch_data
+            pitch_items = tuple(
+                (key, field["value"], field["state"])
+                for key, field in st.session_state.pitch_data.items()
             )
+            st.session_state.evaluation_result = cached_evaluate(pitch_items)
 
     # Display evaluation
     st.header("📊 Investor Evaluation")
@@ -201,6 +285,18 @@ elif st.session_state.mode == "evaluation_result":
     comp_analysis = eval_data.get("competitive_analysis", {})
     st.write("**Market Landscape:**")
     st.write(comp_analysis.get("summary", "N/A"))
+    if comp_analysis.get("direct_competitors"):
+        st.write("**Direct Competitors:**")
+        for competitor in comp_analysis["direct_competitors"]:
+            st.write(f"- {competitor}")
+    if comp_analysis.get("indirect_competitors"):
+        st.write("**Indirect Competitors:**")
+        for competitor in comp_analysis["indirect_competitors"]:
+            st.write(f"- {competitor}")
+    st.write("**Substitute Behaviors:**")
+    st.write(comp_analysis.get("substitute_behaviors", "N/A"))
+    st.write("**Market Dynamics:**")
+    st.write(comp_analysis.get("market_dynamics", "N/A"))
     st.write("**Competitive Advantage Assessment:**")
     st.write(comp_analysis.get("competitive_advantage", "N/A"))
 
@@ -248,10 +344,4 @@ elif st.session_state.mode == "evaluation_result":
             st.rerun()
     with col2:
         if st.button("🔄 Start Over", use_container_width=True):
-            st.session_state.pitch_data = get_default_pitch_data()
-            st.session_state.messages = [
-                {"role": "assistant", "content": "So, what problem are you working on solving?"}
-            ]
-            st.session_state.mode = "ingest"
-            st.session_state.evaluation_result = None
-            st.rerun()
+            reset_session()
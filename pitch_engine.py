@@ -1,7 +1,96 @@
+import asyncio
 import json
-from openai import OpenAI
+import random
+import re
+import threading
+import time
+from openai import OpenAI, AsyncOpenAI, RateLimitError
+from pydantic import BaseModel, ValidationError
 import os
-import copy
+
+# Markers the model uses to embed structured updates in its replies
+_UPDATE_RE = re.compile(r"---UPDATE---\s*(.*?)\s*---END---", re.DOTALL)
+_READY_MARKER = "---READY_FOR_EVALUATION---"
+
+# Ingest is simple extraction plus a short coach reply, well within
+# gpt-4o-mini's range; evaluation keeps gpt-4o for its reasoning
+INGEST_MODEL = os.getenv("INGEST_MODEL", "gpt-4o-mini")
+
+# Only the most recent turns go to the model; the state summary already
+# carries everything extracted from earlier in the conversation
+INGEST_HISTORY_WINDOW = 6
+
+# Cap in-flight API calls per process and back off on 429s so bursty
+# load degrades gracefully instead of cascading errors to users.
+# A threading semaphore covers both sync and async callers (the app runs
+# a fresh event loop per interaction, so a loop-bound primitive won't do).
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "5"))
+_API_SEMAPHORE = threading.Semaphore(MAX_CONCURRENCY)
+_MAX_RETRIES = 5
+
+def _stream_with_permit(stream):
+    """Yields stream chunks, releasing the semaphore once the stream is
+    exhausted or closed"""
+    try:
+        for chunk in stream:
+            yield chunk
+    finally:
+        _API_SEMAPHORE.release()
+
+async def _stream_with_permit_async(stream):
+    """Async twin of _stream_with_permit"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        _API_SEMAPHORE.release()
+
+def _call_chat(client: OpenAI, **kwargs):
+    """chat.completions.create with bounded concurrency and retry.
+
+    For stream=True the permit is held until the returned stream is
+    consumed (or closed), not just until create() hands it back -
+    otherwise in-flight streams would escape the concurrency bound.
+    """
+    _API_SEMAPHORE.acquire()
+    hand_off = False
+    try:
+        for attempt in range(_MAX_RETRIES):
+            try:
+                response = client.chat.completions.create(**kwargs)
+                break
+            except RateLimitError:
+                if attempt == _MAX_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt + random.random())
+        if kwargs.get("stream"):
+            hand_off = True
+            return _stream_with_permit(response)
+        return response
+    finally:
+        if not hand_off:
+            _API_SEMAPHORE.release()
+
+async def _call_chat_async(client: AsyncOpenAI, **kwargs):
+    """Async twin of _call_chat"""
+    _API_SEMAPHORE.acquire()
+    hand_off = False
+    try:
+        for attempt in range(_MAX_RETRIES):
+            try:
+                response = await client.chat.completions.create(**kwargs)
+                break
+            except RateLimitError:
+                if attempt == _MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt + random.random())
+        if kwargs.get("stream"):
+            hand_off = True
+            return _stream_with_permit_async(response)
+        return response
+    finally:
+        if not hand_off:
+            _API_SEMAPHORE.release()
 
 # Field display names and descriptions
 FIELD_INFO = {
@@ -19,58 +108,26 @@ FIELD_INFO = {
     }
 }
 
-def get_default_pitch_data():
-    """Returns the default pitch data structure"""
-    return {
-        "problem_definition": {"value": "", "state": "unknown"},
-        "solution_description": {"value": "", "state": "unknown"},
-        "icp": {"value": "", "state": "unknown"}
-    }
-
-def get_completion_stats(pitch_data):
-    """Calculate completion statistics"""
-    total = len(pitch_data)
-    complete = sum(1 for field in pitch_data.values() if field["state"] == "complete")
-    partial = sum(1 for field in pitch_data.values() if field["state"] == "partial")
-    unknown = sum(1 for field in pitch_data.values() if field["state"] == "unknown")
-
-    return {
-        "total": total,
-        "complete": complete,
-        "partial": partial,
-        "unknown": unknown,
-        "percentage": (complete / total * 100) if total > 0 else 0
-    }
-
-def ingest(client: OpenAI, conversation_history: list, pitch_data: dict) -> dict:
-    """
-    Conversational function to extract and refine pitch data.
-    Returns updated pitch_data and AI response.
-    """
-
-    # Build system prompt with current state
-    stats = get_completion_stats(pitch_data)
-
-    # Create a summary of current state for the AI
-    state_summary = "Current pitch data collection status:\n"
-    for field_key, field_data in pitch_data.items():
-        field_name = FIELD_INFO[field_key]["name"]
-        state = field_data["state"]
-        value = field_data["value"]
-
-        state_summary += f"\n- {field_name}: {state.upper()}"
-        if value:
-            state_summary += f"\n  Current value: {value[:100]}..." if len(value) > 100 else f"\n  Current value: {value}"
-
-    state_summary += f"\n\nProgress: {stats['complete']}/{stats['total']} complete ({stats['percentage']:.0f}%)"
-
-    system_prompt = f"""You are a supportive startup pitch coach having a natural conversation with a founder. Your goal is to understand their:
+# Flat name lookup for the hot per-rerun loops
+FIELD_NAMES = {key: info["name"] for key, info in FIELD_INFO.items()}
+
+class FieldUpdate(BaseModel):
+    """One ---UPDATE--- block extracted from a model reply"""
+    field_key: str
+    value: str = ""
+    state: str = "partial"
+
+# Static portion of the ingest system prompt. Kept as one frozen string
+# with the dynamic state appended after it, so the prompt prefix stays
+# byte-identical across turns. OpenAI prompt caching only kicks in at a
+# 1024-token identical prefix, which is why the worked examples below
+# live here rather than in docs: they push the frozen prefix past the
+# threshold (and measurably improve extraction on terse messages).
+_INGEST_SYSTEM_PREAMBLE = """You are a supportive startup pitch coach having a natural conversation with a founder. Your goal is to understand their:
 1. What problem they're solving
 2. What their solution is
 3. Who their ideal customers are
 
-{state_summary}
-
 CONVERSATION STYLE:
 - Be conversational and natural - avoid mentioning "fields" or structured data
 - Let founders provide information in any order - they can give you everything at once or piece by piece
@@ -88,7 +145,7 @@ EXTRACTION RULES:
 TECHNICAL FORMAT (hidden from user):
 For each piece of information you extract, add a JSON block at the END:
 ---UPDATE---
-{{"field_key": "problem_definition", "value": "the extracted value", "state": "complete"}}
+{"field_key": "problem_definition", "value": "the extracted value", "state": "complete"}
 ---END---
 
 Create one UPDATE block for EACH piece of info you extract. When all 3 are complete, add:
@@ -98,49 +155,117 @@ Information to collect:
 - problem_definition: What problem are they solving? (Can be brief - even 1 sentence is fine)
 - solution_description: What is their solution? (Can be brief - even 1 sentence is fine)
 - icp: Who are their target customers? (Can be brief - even 1-2 words describing the persona is fine)
+
+WORKED EXAMPLES:
+
+Example 1 - everything in one message:
+Founder: "I'm building an AI scheduling assistant for dental clinics because front-desk staff waste hours a day phoning patients to fill cancelled slots."
+Your reply: "Love it - automated backfill for cancellations is a real pain point for clinics. Sounds like you've got a clear picture of the problem and who has it."
+---UPDATE---
+{"field_key": "problem_definition", "value": "Dental clinic front-desk staff waste hours a day phoning patients to fill cancelled appointment slots", "state": "complete"}
+---END---
+---UPDATE---
+{"field_key": "solution_description", "value": "An AI scheduling assistant that automatically backfills cancelled appointment slots", "state": "complete"}
+---END---
+---UPDATE---
+{"field_key": "icp", "value": "Dental clinics (front-desk staff)", "state": "complete"}
+---END---
+---READY_FOR_EVALUATION---
+
+Example 2 - partial info, one piece at a time:
+Founder: "People keep losing track of warranty periods on stuff they buy."
+Your reply: "That's a relatable headache - receipts vanish and deadlines slip by. What are you building to fix it?"
+---UPDATE---
+{"field_key": "problem_definition", "value": "Consumers lose track of warranty periods on products they buy", "state": "complete"}
+---END---
+
+Example 3 - an update that refines an earlier answer:
+Founder: "Actually, we're focusing on property managers, not individual landlords."
+Your reply: "Got it - property managers it is. That changes the sales motion quite a bit, nice to have it pinned down."
+---UPDATE---
+{"field_key": "icp", "value": "Property management companies", "state": "complete"}
+---END---
+
+EDGE CASES AND REMINDERS:
+- If a message contains no new pitch information (small talk, questions to you), reply naturally and emit NO update blocks
+- If the founder contradicts earlier info, emit an update with the new value - the latest statement wins
+- Never invent details the founder didn't say; extract only what is actually in their words
+- Paraphrase extracted values into clean third-person statements, but keep the founder's meaning
+- The update blocks and the READY marker are stripped before display, so never reference them in your visible reply
+- Always place every update block AFTER your conversational reply, never before or inside it
+- Keep each update's value self-contained: it should make sense read on its own, without the surrounding conversation
+- If a message covers two fields but not the third, emit two update blocks and ask one short question about the missing piece
+- Use "partial" state only when the founder was genuinely vague (e.g. "it's for businesses"); follow up once, then accept their answer
+- If the founder asks for pitch advice mid-conversation, give one or two sentences of guidance, then steer back to the missing information
+
+The founder's current progress follows.
+
 """
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        *conversation_history
-    ]
+# Immutable field template; get_default_pitch_data builds fresh mutable
+# dicts from it so callers never share state
+_DEFAULT_TEMPLATE = (
+    ("problem_definition", "unknown"),
+    ("solution_description", "unknown"),
+    ("icp", "unknown"),
+)
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.7
-    )
+def get_default_pitch_data():
+    """Returns a fresh default pitch data structure"""
+    return {key: {"value": "", "state": state} for key, state in _DEFAULT_TEMPLATE}
 
-    ai_message = response.choices[0].message.content
+def get_completion_stats(pitch_data):
+    """Calculate completion statistics in a single pass over the fields"""
+    total = len(pitch_data)
+    complete = partial = unknown = 0
+    for field in pitch_data.values():
+        state = field["state"]
+        if state == "complete":
+            complete += 1
+        elif state == "partial":
+            partial += 1
+        else:
+            unknown += 1
 
-    # Parse any updates from the AI response
-    updated_pitch_data = copy.deepcopy(pitch_data)
-    ready_for_eval = False
-
-    if "---UPDATE---" in ai_message:
-        # Extract update blocks
-        parts = ai_message.split("---UPDATE---")
-        for i in range(1, len(parts)):
-            if "---END---" in parts[i]:
-                json_str = parts[i].split("---END---")[0].strip()
-                try:
-                    update = json.loads(json_str)
-                    field_key = update.get("field_key")
-                    if field_key in updated_pitch_data:
-                        updated_pitch_data[field_key]["value"] = update.get("value", "")
-                        updated_pitch_data[field_key]["state"] = update.get("state", "partial")
-                except json.JSONDecodeError:
-                    pass  # Ignore malformed JSON
-
-    if "---READY_FOR_EVALUATION---" in ai_message:
-        ready_for_eval = True
-
-    # Clean the message for display (remove JSON blocks)
-    display_message = ai_message
-    if "---UPDATE---" in display_message:
-        display_message = display_message.split("---UPDATE---")[0].strip()
-    if "---READY_FOR_EVALUATION---" in display_message:
-        display_message = display_message.replace("---READY_FOR_EVALUATION---", "").strip()
+    return {
+        "total": total,
+        "complete": complete,
+        "partial": partial,
+        "unknown": unknown,
+        "percentage": (complete / total * 100) if total > 0 else 0
+    }
+
+def parse_ingest_response(ai_message: str, pitch_data: dict) -> dict:
+    """
+    Parses a full AI reply for update blocks and the ready marker.
+    Returns updated pitch_data, the cleaned display message, and the
+    ready flag.
+    """
+
+    # Parse any updates from the AI response in a single scan.
+    # pitch_data is a flat dict of {"value", "state"} dicts, so a manual
+    # rebuild gives the same isolation as deepcopy at a fraction of the cost.
+    updated_pitch_data = {
+        key: {"value": field["value"], "state": field["state"]}
+        for key, field in pitch_data.items()
+    }
+    ready_for_eval = _READY_MARKER in ai_message
+
+    for match in _UPDATE_RE.finditer(ai_message):
+        try:
+            update = FieldUpdate.model_validate_json(match.group(1))
+            if update.field_key in updated_pitch_data:
+                updated_pitch_data[update.field_key]["value"] = update.value
+                updated_pitch_data[update.field_key]["state"] = update.state
+        except ValidationError:
+            pass  # Ignore malformed or off-schema JSON
+
+    # Clean the message for display: cut at the first marker literal so a
+    # dangling ---UPDATE--- with no ---END--- (e.g. a truncated reply)
+    # never leaks raw JSON into the chat, then drop the ready marker
+    first_marker = ai_message.find("---UPDATE---")
+    display_message = ai_message[:first_marker] if first_marker != -1 else ai_message
+    display_message = display_message.replace(_READY_MARKER, "").strip()
 
     return {
         "pitch_data": updated_pitch_data,
@@ -148,91 +273,114 @@ Information to collect:
         "ready_for_evaluation": ready_for_eval
     }
 
-def evaluate(client: OpenAI, pitch_data: dict) -> dict:
-    """
-    Evaluates the pitch with an objective, investor perspective.
-    Returns structured evaluation as a dictionary.
-    """
+def _build_ingest_messages(conversation_history: list, pitch_data: dict) -> list:
+    """Assembles the message list for an ingest call"""
 
-    # Build pitch summary for evaluation
-    pitch_summary = "PITCH SUMMARY:\n\n"
+    # Build system prompt with current state
+    stats = get_completion_stats(pitch_data)
+
+    # Create a summary of current state for the AI (single join, no
+    # repeated string concatenation)
+    lines = ["Current pitch data collection status:\n"]
     for field_key, field_data in pitch_data.items():
-        field_name = FIELD_INFO[field_key]["name"]
+        lines.append(f"\n- {FIELD_NAMES[field_key]}: {field_data['state'].upper()}")
         value = field_data["value"]
-        pitch_summary += f"{field_name}:\n{value}\n\n"
+        if value:
+            suffix = "..." if len(value) > 100 else ""
+            lines.append(f"\n  Current value: {value[:100]}{suffix}")
 
-    # Step 1: Perform web search to gather competitive intelligence using OpenAI's web_search tool
-    web_research_prompt = f"""Research the competitive landscape for this startup pitch using web search. Find REAL, current information about:
+    lines.append(f"\n\nProgress: {stats['complete']}/{stats['total']} complete ({stats['percentage']:.0f}%)")
+    state_summary = "".join(lines)
 
-{pitch_summary}
+    system_prompt = _INGEST_SYSTEM_PREAMBLE + state_summary
 
-Search for and identify:
-1. **Direct competitors** - Companies solving the exact same problem with similar solutions (find 2-3 specific company names with their funding, market position, and key features)
-2. **Indirect competitors** - Alternative approaches or solutions in this space (identify 2-3 specific companies or solution categories)
-3. **Market dynamics** - Recent funding rounds, acquisitions, market trends, growth rates in this space
+    # Bound input tokens: long refinement sessions would otherwise grow
+    # the prompt (and latency) linearly with turn count
+    recent_history = conversation_history[-INGEST_HISTORY_WINDOW:]
 
-Provide SPECIFIC company names, funding amounts, founding dates, and verifiable data. Cite sources."""
+    return [
+        {"role": "system", "content": system_prompt},
+        *recent_history
+    ]
 
-    # For now, use GPT-4o's knowledge base for competitive research
-    # Web search via OpenAI API is not available in standard API
-    research_response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a startup research analyst with extensive knowledge of tech companies, funding data, and market trends. Provide specific company names and data based on your training data."},
-            {"role": "user", "content": web_research_prompt}
-        ],
-        temperature=0.3
-    )
+def ingest(client: OpenAI, conversation_history: list, pitch_data: dict, stream: bool = False):
+    """
+    Conversational function to extract and refine pitch data.
+    Returns updated pitch_data and AI response. With stream=True, returns
+    the raw completion stream instead; pass the joined text to
+    parse_ingest_response once it finishes.
+    """
 
-    web_research_results = research_response.choices[0].message.content
+    messages = _build_ingest_messages(conversation_history, pitch_data)
 
-    # Step 2: Structure the competitive analysis with web search data
-    competitive_analysis_prompt = f"""Based on the web search findings below, create a structured competitive landscape analysis:
+    if stream:
+        return _call_chat(
+            client,
+            model=INGEST_MODEL,
+            messages=messages,
+            temperature=0.7,
+            stream=True
+        )
 
-{pitch_summary}
+    response = _call_chat(
+        client,
+        model=INGEST_MODEL,
+        messages=messages,
+        temperature=0.7
+    )
 
-RESEARCH FINDINGS:
-{web_research_results}
+    ai_message = response.choices[0].message.content
 
-Structure your analysis as follows:
+    return parse_ingest_response(ai_message, pitch_data)
 
-**DIRECT COMPETITORS:**
-List 2-3 companies solving the exact same problem with similar approaches. For each:
-- Company name and brief description
-- Why they matter (market share, funding, user base)
-- Key differentiators from this pitch
+async def ingest_async(client: AsyncOpenAI, conversation_history: list, pitch_data: dict, stream: bool = False):
+    """
+    Async twin of ingest: awaiting the API call frees the event loop
+    during the network wait instead of blocking a worker thread.
+    """
 
-**INDIRECT COMPETITORS:**
-List 2-3 solutions that address the same need differently. For each:
-- Solution type and key players
-- Why users choose this alternative
-- What makes it competitive
+    messages = _build_ingest_messages(conversation_history, pitch_data)
 
-**SUBSTITUTE BEHAVIORS:**
-What do people do today when they don't use any product? Why does this matter?
+    if stream:
+        return await _call_chat_async(
+            client,
+            model=INGEST_MODEL,
+            messages=messages,
+            temperature=0.7,
+            stream=True
+        )
 
-**MARKET DYNAMICS:**
-- Recent funding/exits in this space
-- Market trends (growing/declining/saturated)
-- Switching costs and user lock-in factors
+    response = await _call_chat_async(
+        client,
+        model=INGEST_MODEL,
+        messages=messages,
+        temperature=0.7
+    )
 
-Use the research findings to provide SPECIFIC company names and data. If data is unavailable, note that explicitly."""
+    ai_message = response.choices[0].message.content
 
-    competitive_response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a startup research analyst synthesizing research into a structured competitive analysis. Use specific company names and data from the research provided."},
-            {"role": "user", "content": competitive_analysis_prompt}
-        ],
-        temperature=0.5
-    )
+    return parse_ingest_response(ai_message, pitch_data)
+
+def evaluate(client: OpenAI, pitch_data: dict) -> dict:
+    """
+    Evaluates the pitch with an objective, investor perspective.
+    A single JSON-mode call covers competitive research and the structured
+    evaluation, instead of separate research/synthesis/evaluation requests.
+    Returns structured evaluation as a dictionary.
+    """
 
-    competitive_analysis = competitive_response.choices[0].message.content
+    # Build pitch summary for evaluation
+    pitch_summary = "PITCH SUMMARY:\n\n"
+    for field_key, field_data in pitch_data.items():
+        field_name = FIELD_NAMES[field_key]
+        value = field_data["value"]
+        pitch_summary += f"{field_name}:\n{value}\n\n"
 
-    # Step 2: Structured evaluation
     system_prompt = f"""You are a savvy YC-style investor evaluating startup pitches. Be OBJECTIVE and HONEST.
 
-Evaluate this pitch and respond with a JSON object with these exact fields:
+You also have extensive knowledge of tech companies, funding data, and market trends. Before scoring, internally reason about the competitive landscape for this pitch: direct competitors (specific company names, funding, market position), indirect competitors and alternative approaches, what people do today without any product, and recent funding/exits and market trends in this space. Use SPECIFIC company names and data from your training data; if data is unavailable, note that explicitly.
+
+Then respond with a JSON object with these exact fields:
 
 {{
   "problem_clarity": {{
@@ -244,7 +392,11 @@ Evaluate this pitch and respond with a JSON object with these exact fields:
     "assessment": "How painful is this problem? Is it a must-have or nice-to-have? Do people actively seek solutions?"
   }},
   "competitive_analysis": {{
-    "summary": "Use the competitive research provided below",
+    "direct_competitors": ["2-3 companies solving the exact same problem with similar approaches - name, why they matter, key differentiators from this pitch"],
+    "indirect_competitors": ["2-3 solutions that address the same need differently - solution type, key players, why users choose them"],
+    "substitute_behaviors": "What do people do today when they don't use any product? Why does this matter?",
+    "market_dynamics": "Recent funding/exits, market trends (growing/declining/saturated), switching costs and user lock-in factors",
+    "summary": "Overall market landscape synthesis",
     "competitive_advantage": "Critical assessment of whether this solution is actually better/defensible"
   }},
   "gtm_challenges": {{
@@ -269,9 +421,6 @@ Evaluate this pitch and respond with a JSON object with these exact fields:
   }}
 }}
 
-COMPETITIVE RESEARCH:
-{competitive_analysis}
-
 Be harsh and realistic. Don't sugarcoat. Focus on what actually matters for venture-scale returns."""
 
     messages = [
@@ -279,7 +428,8 @@ Be harsh and realistic. Don't sugarcoat. Focus on what actually matters for vent
         {"role": "user", "content": f"Evaluate this pitch:\n\n{pitch_summary}"}
     ]
 
-    response = client.chat.completions.create(
+    response = _call_chat(
+        client,
         model="gpt-4o",
         messages=messages,
         temperature=0.7,
@@ -289,6 +439,5 @@ Be harsh and realistic. Don't sugarcoat. Focus on what actually matters for vent
     evaluation_json = json.loads(response.choices[0].message.content)
 
     return {
-        "evaluation": evaluation_json,
-        "competitive_analysis_full": competitive_analysis
+        "evaluation": evaluation_json
     }